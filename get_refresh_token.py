@@ -4,9 +4,8 @@ Script to obtain Google Photos API refresh token.
 Run this script and follow the prompts.
 """
 import urllib.parse
-import urllib.request
 import json
-import webbrowser
+import oauth_common
 
 # Your OAuth credentials
 # Set these as environment variables or replace the placeholders below
@@ -20,6 +19,9 @@ if CLIENT_ID == "YOUR_CLIENT_ID_HERE" or CLIENT_SECRET == "YOUR_CLIENT_SECRET_HE
     print("Or edit this script to replace YOUR_CLIENT_ID_HERE and YOUR_CLIENT_SECRET_HERE")
     exit(1)
 
+# Shared connection to the token endpoint (see oauth_common.connect)
+_HTTP = oauth_common.connect()
+
 # Google Photos API scopes
 # Scopes must be space-separated in the OAuth URL
 scopes = [
@@ -29,19 +31,14 @@ scopes = [
 scope_string = " ".join(scopes)  # Space-separated, not plus-separated
 
 # Step 1: Construct authorization URL
-auth_url = (
-    "https://accounts.google.com/o/oauth2/v2/auth?"
-    "client_id={}&"
-    "redirect_uri={}&"
-    "response_type=code&"
-    "scope={}&"
-    "access_type=offline&"
-    "prompt=consent"
-).format(
-    CLIENT_ID,
-    urllib.parse.quote(REDIRECT_URI),
-    urllib.parse.quote(scope_string)
-)
+auth_url = "https://accounts.google.com/o/oauth2/v2/auth?" + urllib.parse.urlencode({
+    "client_id": CLIENT_ID,
+    "redirect_uri": REDIRECT_URI,
+    "response_type": "code",
+    "scope": scope_string,
+    "access_type": "offline",
+    "prompt": "consent"
+}, quote_via=urllib.parse.quote)
 
 print("=" * 70)
 print("Google Photos API - Refresh Token Generator")
@@ -62,6 +59,7 @@ print("\n" + auth_url + "\n")
 
 # Try to open the URL in the browser
 try:
+    import webbrowser
     webbrowser.open(auth_url)
     print("Browser opened! Please authorize the application.")
 except:
@@ -86,23 +84,8 @@ if not auth_code:
 
 # Step 2: Exchange authorization code for tokens
 print("\nExchanging authorization code for tokens...")
-token_url = "https://oauth2.googleapis.com/token"
-data = urllib.parse.urlencode({
-    "code": auth_code,
-    "client_id": CLIENT_ID,
-    "client_secret": CLIENT_SECRET,
-    "redirect_uri": REDIRECT_URI,
-    "grant_type": "authorization_code"
-}).encode()
-
 try:
-    req = urllib.request.Request(
-        token_url, 
-        data=data, 
-        headers={"Content-Type": "application/x-www-form-urlencoded"}
-    )
-    response = urllib.request.urlopen(req)
-    tokens = json.loads(response.read().decode())
+    tokens = oauth_common.exchange_code(auth_code, CLIENT_ID, CLIENT_SECRET, REDIRECT_URI, _HTTP)
     
     if "refresh_token" not in tokens:
         print("\n" + "=" * 70)
@@ -113,6 +96,10 @@ try:
         print("=" * 70)
         print("\nResponse received:")
         print(json.dumps(tokens, indent=2))
+
+        # The access token is still usable until it expires
+        oauth_common.save_tokens(tokens)
+        print(f"\nTokens saved to: {oauth_common.TOKENS_FILE}")
     else:
         print("\n" + "=" * 70)
         print("SUCCESS! Your refresh token:")
@@ -122,25 +109,14 @@ try:
         print("Save this as your GOOGLE_PHOTOS_REFRESH_TOKEN environment variable")
         print("=" * 70)
         
-        # Also save to a file for convenience
-        with open("refresh_token.txt", "w") as f:
-            f.write(tokens["refresh_token"])
-        print("\nRefresh token also saved to: refresh_token.txt")
+        # Also save the full token response for convenience
+        oauth_common.save_tokens(tokens)
+        print(f"\nTokens also saved to: {oauth_common.TOKENS_FILE}")
+        print(f"Refresh token also saved to: {oauth_common.LEGACY_REFRESH_TOKEN_FILE} "
+              f"(deprecated, use {oauth_common.TOKENS_FILE})")
         
-except urllib.error.HTTPError as e:
-    error_body = e.read().decode()
-    print("\n" + "=" * 70)
-    print("ERROR: Failed to exchange authorization code")
-    print("=" * 70)
-    print(f"Status: {e.code}")
-    print(f"Response: {error_body}")
-    print("=" * 70)
-    try:
-        error_json = json.loads(error_body)
-        if "error_description" in error_json:
-            print(f"\nError: {error_json['error_description']}")
-    except:
-        pass
+except oauth_common.TokenHTTPError as e:
+    oauth_common.print_exchange_error(e)
 except Exception as e:
     print("\n" + "=" * 70)
     print("ERROR: An unexpected error occurred")
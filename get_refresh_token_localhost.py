@@ -4,13 +4,9 @@ Script to obtain Google Photos API refresh token using localhost redirect.
 This version starts a local server to catch the OAuth redirect.
 """
 import urllib.parse
-import urllib.request
 import json
-import webbrowser
-import http.server
-import socketserver
+import oauth_common
 from urllib.parse import urlparse, parse_qs
-import threading
 
 # Your OAuth credentials
 # Set these as environment variables or replace the placeholders below
@@ -24,6 +20,15 @@ if CLIENT_ID == "YOUR_CLIENT_ID_HERE" or CLIENT_SECRET == "YOUR_CLIENT_SECRET_HE
     print("Or edit this script to replace YOUR_CLIENT_ID_HERE and YOUR_CLIENT_SECRET_HERE")
     exit(1)
 
+# Imported only after the credentials check so the misconfiguration path
+# exits without loading the server modules
+import http.server
+import html
+import threading
+
+# Shared connection to the token endpoint (see oauth_common.connect)
+_HTTP = oauth_common.connect()
+
 # Google Photos API scopes
 # Note: As of March 2025, Google deprecated the photoslibrary scope
 # New scopes only allow access to app-created albums/media
@@ -35,79 +40,117 @@ scopes = [
 ]
 scope_string = " ".join(scopes)  # Space-separated, not plus-separated
 
-# Global variable to store the authorization code
+# Global variables to store the authorization code and the exchange result.
+# The handler exchanges the code as soon as it arrives, so exchange_done is
+# the only thing the main thread waits on.
 auth_code = None
-code_received = threading.Event()
+token_response = None
+exchange_error = None
+exchange_done = threading.Event()
+# Requests run on separate server threads, so only the first redirect carrying
+# a code may claim the exchange; reloads or duplicate navigations would
+# otherwise reuse _HTTP concurrently or resend a used code and overwrite the
+# result
+exchange_lock = threading.Lock()
+exchange_claimed = False
+
+# Static responses are encoded once so each request only writes bytes
+_OK_HTML = b"""<html>
+<head><title>Authorization Successful</title></head>
+<body>
+<h1>Authorization Successful!</h1>
+<p>You can close this window and return to the terminal.</p>
+</body>
+</html>
+"""
+_OK_LEN = str(len(_OK_HTML))
+_WAITING_HTML = b"<html><body>Waiting for authorization...</body></html>"
+_WAITING_LEN = str(len(_WAITING_HTML))
 
 class OAuthHandler(http.server.SimpleHTTPRequestHandler):
+    def _send_html(self, status, body, length=None):
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html')
+        self.send_header('Content-Length', length or str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
     def do_GET(self):
-        global auth_code
+        global auth_code, token_response, exchange_error, exchange_claimed
         parsed_url = urlparse(self.path)
+
+        # Browsers request a favicon alongside the redirect; answer without a body
+        if parsed_url.path == '/favicon.ico':
+            self.send_response(204)
+            self.end_headers()
+            return
+
         query_params = parse_qs(parsed_url.query)
         
         if 'code' in query_params:
-            auth_code = query_params['code'][0]
-            self.send_response(200)
-            self.send_header('Content-type', 'text/html')
-            self.end_headers()
-            self.wfile.write(b"""
-            <html>
-            <head><title>Authorization Successful</title></head>
-            <body>
-            <h1>Authorization Successful!</h1>
-            <p>You can close this window and return to the terminal.</p>
-            </body>
-            </html>
-            """)
-            code_received.set()
+            with exchange_lock:
+                claimed = not exchange_claimed
+                if claimed:
+                    exchange_claimed = True
+                    auth_code = query_params['code'][0]
+            try:
+                self._send_html(200, _OK_HTML, _OK_LEN)
+                self.wfile.flush()
+            except OSError:
+                # The browser went away; the code is still good to exchange
+                pass
+            if not claimed:
+                return
+            # Exchange the code on this handler thread right after the page is
+            # sent, instead of handing it back to the main thread first
+            print("\nAuthorization code received! Exchanging for tokens...")
+            try:
+                token_response = oauth_common.exchange_code(
+                    auth_code, CLIENT_ID, CLIENT_SECRET, REDIRECT_URI, _HTTP
+                )
+            except Exception as e:
+                exchange_error = e
+            exchange_done.set()
+            # Stop serve_forever from another thread once this response is sent
+            threading.Thread(target=start_local_server.httpd.shutdown, daemon=True).start()
         elif 'error' in query_params:
-            error = query_params['error'][0]
-            error_desc = query_params.get('error_description', [''])[0]
-            self.send_response(400)
-            self.send_header('Content-type', 'text/html')
-            self.end_headers()
-            self.wfile.write(f"""
-            <html>
-            <head><title>Authorization Failed</title></head>
-            <body>
-            <h1>Authorization Failed</h1>
-            <p>Error: {error}</p>
-            <p>{error_desc}</p>
-            </body>
-            </html>
-            """.encode())
+            error = html.escape(query_params['error'][0])
+            error_desc = html.escape(query_params.get('error_description', [''])[0])
+            self._send_html(400, f"""<html>
+<head><title>Authorization Failed</title></head>
+<body>
+<h1>Authorization Failed</h1>
+<p>Error: {error}</p>
+<p>{error_desc}</p>
+</body>
+</html>
+""".encode())
         else:
-            self.send_response(200)
-            self.send_header('Content-type', 'text/html')
-            self.end_headers()
-            self.wfile.write(b"<html><body>Waiting for authorization...</body></html>")
+            self._send_html(200, _WAITING_HTML, _WAITING_LEN)
 
 def start_local_server():
     """Start a local HTTP server to catch the OAuth redirect"""
     port = 8080
-    handler = OAuthHandler
-    httpd = socketserver.TCPServer(("", port), handler)
+    # Threaded so an idle browser preconnect socket cannot block the redirect;
+    # OAuthHandler guards its shared state with exchange_lock
+    httpd = http.server.ThreadingHTTPServer(("127.0.0.1", port), OAuthHandler)
+    httpd.daemon_threads = True
+    start_local_server.httpd = httpd
     print(f"Local server started on http://localhost:{port}")
     print("Waiting for OAuth redirect...")
-    httpd.timeout = 300  # 5 minute timeout
-    while not code_received.is_set():
-        httpd.handle_request()
-    return auth_code
+    # Runs until OAuthHandler calls shutdown(); the main thread's
+    # exchange_done.wait() enforces the overall timeout
+    httpd.serve_forever()
 
 # Step 1: Construct authorization URL
-auth_url = (
-    "https://accounts.google.com/o/oauth2/v2/auth?"
-    "client_id={}&"
-    "redirect_uri={}&"
-    "response_type=code&"
-    "scope={}&"
-    "access_type=offline&"
-    "prompt=consent"
-).format(
-    CLIENT_ID,
-    urllib.parse.quote(REDIRECT_URI),
-    urllib.parse.quote(scope_string)
-)
+auth_url = "https://accounts.google.com/o/oauth2/v2/auth?" + urllib.parse.urlencode({
+    "client_id": CLIENT_ID,
+    "redirect_uri": REDIRECT_URI,
+    "response_type": "code",
+    "scope": scope_string,
+    "access_type": "offline",
+    "prompt": "consent"
+}, quote_via=urllib.parse.quote)
 
 print("=" * 70)
 print("Google Photos API - Refresh Token Generator (Localhost Method)")
@@ -132,39 +175,26 @@ server_thread.start()
 
 # Try to open the URL in the browser
 try:
+    import webbrowser
     webbrowser.open(auth_url)
     print("Browser opened! Please authorize the application.")
 except:
     print("Could not open browser automatically. Please copy the URL above.")
 
-# Wait for the authorization code
+# Wait for the authorization code and the token exchange
 print("\nWaiting for authorization...")
-code_received.wait(timeout=300)  # 5 minute timeout
-
-if not auth_code:
-    print("\nTimeout: No authorization code received.")
+if not exchange_done.wait(timeout=300):  # 5 minute timeout
+    if auth_code:
+        print("\nTimeout: Token exchange did not complete.")
+    else:
+        print("\nTimeout: No authorization code received.")
     exit(1)
 
-print("\nAuthorization code received! Exchanging for tokens...")
-
-# Step 2: Exchange authorization code for tokens
-token_url = "https://oauth2.googleapis.com/token"
-data = urllib.parse.urlencode({
-    "code": auth_code,
-    "client_id": CLIENT_ID,
-    "client_secret": CLIENT_SECRET,
-    "redirect_uri": REDIRECT_URI,
-    "grant_type": "authorization_code"
-}).encode()
-
+# Step 2: Report the tokens exchanged by the redirect handler
 try:
-    req = urllib.request.Request(
-        token_url, 
-        data=data, 
-        headers={"Content-Type": "application/x-www-form-urlencoded"}
-    )
-    response = urllib.request.urlopen(req)
-    tokens = json.loads(response.read().decode())
+    if exchange_error:
+        raise exchange_error
+    tokens = token_response
     
     if "refresh_token" not in tokens:
         print("\n" + "=" * 70)
@@ -174,6 +204,10 @@ try:
         print("=" * 70)
         print("\nResponse received:")
         print(json.dumps(tokens, indent=2))
+
+        # The access token is still usable until it expires
+        oauth_common.save_tokens(tokens)
+        print(f"\nTokens saved to: {oauth_common.TOKENS_FILE}")
     else:
         print("\n" + "=" * 70)
         print("SUCCESS! Your refresh token:")
@@ -183,25 +217,14 @@ try:
         print("Save this as your GOOGLE_PHOTOS_REFRESH_TOKEN environment variable")
         print("=" * 70)
         
-        # Also save to a file for convenience
-        with open("refresh_token.txt", "w") as f:
-            f.write(tokens["refresh_token"])
-        print("\nRefresh token also saved to: refresh_token.txt")
+        # Also save the full token response for convenience
+        oauth_common.save_tokens(tokens)
+        print(f"\nTokens also saved to: {oauth_common.TOKENS_FILE}")
+        print(f"Refresh token also saved to: {oauth_common.LEGACY_REFRESH_TOKEN_FILE} "
+              f"(deprecated, use {oauth_common.TOKENS_FILE})")
         
-except urllib.error.HTTPError as e:
-    error_body = e.read().decode()
-    print("\n" + "=" * 70)
-    print("ERROR: Failed to exchange authorization code")
-    print("=" * 70)
-    print(f"Status: {e.code}")
-    print(f"Response: {error_body}")
-    print("=" * 70)
-    try:
-        error_json = json.loads(error_body)
-        if "error_description" in error_json:
-            print(f"\nError: {error_json['error_description']}")
-    except:
-        pass
+except oauth_common.TokenHTTPError as e:
+    oauth_common.print_exchange_error(e)
 except Exception as e:
     print("\n" + "=" * 70)
     print("ERROR: An unexpected error occurred")
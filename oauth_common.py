@@ -0,0 +1,98 @@
+"""
+Shared helpers for the Google Photos refresh token scripts.
+Handles the authorization code exchange and saving the token response.
+"""
+import urllib.parse
+import json
+import os
+import time
+
+TOKEN_HOST = "oauth2.googleapis.com"
+TOKEN_PATH = "/token"
+TOKENS_FILE = "tokens.json"
+# Deprecated: the bare refresh token is still written here for one release
+# so existing scripts that read it keep working; use TOKENS_FILE instead
+LEGACY_REFRESH_TOKEN_FILE = "refresh_token.txt"
+
+# Treat the access token as expired this many seconds early so a consumer
+# never sends one that lapses mid-request
+EXPIRY_MARGIN = 60
+
+
+class TokenHTTPError(Exception):
+    """Non-2xx response from the token endpoint"""
+    def __init__(self, code, body):
+        super().__init__(f"HTTP {code}")
+        self.code = code
+        self.body = body
+
+
+def connect():
+    """Return a keep-alive HTTPS connection to the token endpoint.
+
+    Keep it at module scope in the caller so later OAuth round-trips in the
+    same process skip the TCP + TLS handshake.
+    """
+    # Deferred so importing this module does not pull in http.client and ssl
+    import http.client
+    return http.client.HTTPSConnection(TOKEN_HOST, timeout=30)
+
+
+def exchange_code(auth_code, client_id, client_secret, redirect_uri, http_client):
+    """Exchange an authorization code for tokens and return the JSON response"""
+    data = urllib.parse.urlencode({
+        "code": auth_code,
+        "client_id": client_id,
+        "client_secret": client_secret,
+        "redirect_uri": redirect_uri,
+        "grant_type": "authorization_code"
+    }).encode()
+    http_client.request(
+        "POST",
+        TOKEN_PATH,
+        body=data,
+        headers={"Content-Type": "application/x-www-form-urlencoded"}
+    )
+    response = http_client.getresponse()
+    body = response.read().decode()
+    if not 200 <= response.status < 300:
+        raise TokenHTTPError(response.status, body)
+    return json.loads(body)
+
+
+def _write_private(path, text):
+    """Write text to path, readable only by the owner"""
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    # The mode above only applies on creation; tighten files left by older versions
+    os.fchmod(fd, 0o600)
+    with os.fdopen(fd, "w") as f:
+        f.write(text)
+
+
+def save_tokens(tokens, path=TOKENS_FILE):
+    """Write the full token response to path, adding an absolute expires_at.
+
+    The refresh token, if present, is also written to LEGACY_REFRESH_TOKEN_FILE.
+    """
+    cached = dict(tokens)
+    if "expires_in" in tokens:
+        cached["expires_at"] = time.time() + tokens["expires_in"] - EXPIRY_MARGIN
+    _write_private(path, json.dumps(cached, indent=2))
+    if "refresh_token" in tokens:
+        _write_private(LEGACY_REFRESH_TOKEN_FILE, tokens["refresh_token"])
+
+
+def print_exchange_error(e):
+    """Print a failed token exchange in the scripts' banner format"""
+    print("\n" + "=" * 70)
+    print("ERROR: Failed to exchange authorization code")
+    print("=" * 70)
+    print(f"Status: {e.code}")
+    print(f"Response: {e.body}")
+    print("=" * 70)
+    try:
+        error_json = json.loads(e.body)
+        if "error_description" in error_json:
+            print(f"\nError: {error_json['error_description']}")
+    except ValueError:
+        pass